@@ -1,15 +1,18 @@
 import unittest
 from datetime import datetime, timedelta
+import numpy as np
+import cf
 import unifhy
 
 from unifhycontrib.gr4 import (
-    SurfaceLayerComponent, SubSurfaceComponent, OpenWaterComponent
+    SurfaceLayerComponent, SubSurfaceComponent, OpenWaterComponent,
+    run_all_timesteps
 )
 
 
 class TestContribution(unittest.TestCase):
 
-    def test_gr4j(self):
+    def run_gr4j(self, identifier, land_sea_mask=False):
         td = unifhy.TimeDomain.from_start_end_step(
             start=datetime(2001, 1, 1, 0, 0, 0),
             end=datetime(2002, 1, 1, 0, 0, 0),
@@ -23,6 +26,17 @@ class TestContribution(unittest.TestCase):
             longitude_resolution=1
         )
 
+        if land_sea_mask:
+            # all-land mask, for transfers to be given as masked arrays
+            # (read from file to be kept in the configuration file)
+            mask = sd.to_field()
+            mask.set_data(np.ones(mask.shape, dtype='i1'))
+            mask.standard_name = 'land_binary_mask'
+            cf.write(mask, f'out/{identifier}_land_sea_mask.nc')
+            sd.land_sea_mask = cf.read(
+                f'out/{identifier}_land_sea_mask.nc'
+            ).select_field('land_binary_mask')
+
         ds = unifhy.DataSet(['in/rainfall_flux.nc',
                              'in/potential_water_evapotranspiration_flux.nc'])
 
@@ -71,7 +85,7 @@ class TestContribution(unittest.TestCase):
         )
 
         model = unifhy.Model(
-            identifier='test-gr4j',
+            identifier=identifier,
             config_directory='out',
             saving_directory='out',
             surfacelayer=sl,
@@ -81,7 +95,7 @@ class TestContribution(unittest.TestCase):
 
         model.to_yaml()
 
-        model = unifhy.Model.from_yaml('out/test-gr4j.yml')
+        model = unifhy.Model.from_yaml(f'out/{identifier}.yml')
 
         model.simulate()
 
@@ -90,14 +104,178 @@ class TestContribution(unittest.TestCase):
         )
 
         from_model = unifhy.DataSet(
-            'out/test-gr4j_openwater_run_records_daily.nc'
+            f'out/{identifier}_openwater_run_records_daily.nc'
         )
 
         var_name = 'outgoing_water_volume_transport_along_river_channel'
 
+        return from_file[var_name].field, from_model[var_name].field
+
+    @staticmethod
+    def run_gr4j_numpy(rainfall, potential_evapotranspiration,
+                       x1, x2, x3, x4, dt,
+                       alpha, beta, nu, gamma, omega, phi, nres):
+        # reference implementation in plain numpy following the original
+        # formulation of the components (with time as first dimension,
+        # and the transfers between components lagged by one timestep)
+        nu = nu * (86400 / dt) ** 0.25
+        x2 = x2 * (86400 / dt) ** -0.125
+        x3 = x3 * (86400 / dt) ** 0.25
+        x4 = x4 * (86400 / dt)
+
+        shape = rainfall.shape[1:]
+        s = np.zeros(shape)
+        sh = np.zeros(shape + (nres,))
+        r = np.zeros(shape)
+        s_over_x1, pn, es, quh = (np.zeros(shape) for _ in range(4))
+
+        q = np.zeros(rainfall.shape)
+
+        for t in range(rainfall.shape[0]):
+            # surface layer
+            p = rainfall[t] * dt
+            e = potential_evapotranspiration[t] * dt
+            e_minus_p = e - p
+            tanh_en_over_x1 = np.tanh(
+                np.minimum(np.maximum(e_minus_p, 0.0) / x1, 13.0)
+            )
+            s_sl = s_over_x1 * x1
+            es_t = np.where(
+                e_minus_p >= 0.0,
+                ((2 * s_sl - s_sl ** alpha / x1) * tanh_en_over_x1)
+                / (1 + (1 - s_over_x1) * tanh_en_over_x1),
+                0.0
+            )
+            pn_t = np.maximum(-e_minus_p, 0.0)
+
+            # subsurface
+            tanh_pn_over_x1 = np.tanh(np.minimum(pn / x1, 13.0))
+            ps = (
+                (x1 * (1 - (s / x1) ** alpha) * tanh_pn_over_x1)
+                / (1 + s / x1 * tanh_pn_over_x1)
+            )
+            pr = pn - ps
+            s = np.maximum(s + ps - es, 0.0)
+            perc = s * (1 - (1 + (nu * s / x1) ** (beta - 1))
+                        ** (1 / (1 - beta)))
+            pr += perc
+            s -= perc
+
+            outflow_coefficient = 1 - np.exp((1 - nres) / x4)
+            qsh = pr
+            for i in range(nres):
+                sh[..., i] += qsh
+                qsh = sh[..., i] * outflow_coefficient
+                sh[..., i] -= qsh
+            quh_t = qsh
+
+            # openwater
+            q9 = quh * phi
+            q1 = quh - q9
+            f = x2 * (r / x3) ** omega
+            r = r + q9 + f
+            qr = r * (1 - (1 + (r / x3) ** (gamma - 1))
+                      ** (1 / (1 - gamma)))
+            r = np.maximum(r - qr, 0.0)
+            qd = np.maximum(q1 + f, 0.0)
+            q[t] = np.maximum(qr + qd, 0.0) / dt
+
+            # transfers available to the components at next timestep
+            s_over_x1 = s / x1
+            pn, es, quh = pn_t, es_t, quh_t
+
+        return q
+
+    def test_gr4j(self):
+        from_file, from_model = self.run_gr4j('test-gr4j')
+
+        self.assertTrue(
+            from_file.equals(from_model, verbose=3)
+        )
+
+    def test_gr4j_land_sea_mask(self):
+        from_file, from_model = self.run_gr4j('test-gr4j-land-sea-mask',
+                                              land_sea_mask=True)
+
+        self.assertTrue(
+            from_file.equals(from_model, verbose=3)
+        )
+
+    def test_gr4j_single_precision(self):
+        dtype = unifhy.dtype_float()
+        unifhy.dtype_float('float32')
+        try:
+            from_file, from_model = self.run_gr4j('test-gr4j-float32')
+        finally:
+            unifhy.dtype_float(dtype)
+
+        self.assertTrue(
+            from_file.equals(from_model, rtol=1e-4, atol=1e-9,
+                             ignore_data_type=True, verbose=3)
+        )
+
+    def test_gr4j_run_all_timesteps(self):
+        ds = unifhy.DataSet(['in/rainfall_flux.nc',
+                             'in/potential_water_evapotranspiration_flux.nc'])
+
+        from_file = unifhy.DataSet(
+            'in/outgoing_water_volume_transport_along_river_channel.nc'
+        )
+
+        var_name = 'outgoing_water_volume_transport_along_river_channel'
+
+        # time needs to be the last dimension
+        from_batch = run_all_timesteps(
+            np.moveaxis(ds['rainfall_flux'].field.array, 0, -1),
+            np.moveaxis(
+                ds['potential_water_evapotranspiration_flux'].field.array,
+                0, -1
+            ),
+            346.9290884, -0.0458, 119.780094, 0.9384945,
+            0.0, np.zeros(11), 0.0,
+            86400.0,
+            2, 5, 4/9, 5, 3.5, 0.9
+        )
+
+        self.assertTrue(
+            np.allclose(np.moveaxis(from_batch, -1, 0),
+                        from_file[var_name].field.array,
+                        rtol=0, atol=1e-16)
+        )
+
+    def test_gr4j_run_all_timesteps_non_default_constants(self):
+        ds = unifhy.DataSet(['in/rainfall_flux.nc',
+                             'in/potential_water_evapotranspiration_flux.nc'])
+
+        rainfall = ds['rainfall_flux'].field.array
+        potential_evapotranspiration = (
+            ds['potential_water_evapotranspiration_flux'].field.array
+        )
+
+        # non-default constants (i.e. alpha, beta, nu, gamma, omega,
+        # phi, and nres) so that the general power laws are used
+        parameters = (346.9290884, -0.0458, 119.780094, 0.9384945)
+        constants = (1.5, 4, 0.5, 6, 3, 0.8)
+        nres = 7
+
+        from_numpy = self.run_gr4j_numpy(
+            rainfall, potential_evapotranspiration,
+            *parameters, 86400.0, *constants, nres
+        )
+
+        # time needs to be the last dimension
+        from_batch = run_all_timesteps(
+            np.moveaxis(rainfall, 0, -1),
+            np.moveaxis(potential_evapotranspiration, 0, -1),
+            *parameters,
+            0.0, np.zeros(nres), 0.0,
+            86400.0,
+            *constants
+        )
+
         self.assertTrue(
-            from_file[var_name].field.equals(from_model[var_name].field,
-                                             verbose=3)
+            np.allclose(np.moveaxis(from_batch, -1, 0), from_numpy,
+                        rtol=0, atol=1e-16)
         )
 
 
@@ -1,3 +1,4 @@
 from .surfacelayer import SurfaceLayerComponent
 from .subsurface import SubSurfaceComponent
 from .openwater import OpenWaterComponent
+from .batch import run_all_timesteps
@@ -0,0 +1,51 @@
+import math
+
+import numba
+import numpy as np
+
+
+def as_kernel_array(array, dtype):
+    """Return *array* flattened over its dimensions, as a plain array
+    (i.e. with the mask of a masked array dropped, the compiled kernels
+    not supporting masked arrays) of floating point precision *dtype*
+    (e.g. for transfers averaged in double precision by the exchanger),
+    without copy if possible.
+    """
+    return np.ravel(np.ma.getdata(array)).astype(dtype, copy=False)
+
+
+@numba.njit(cache=True, fastmath=True)
+def tanh_limited(x_over_x1):
+    """Return the hyperbolic tangent of the ratio of a water (or energy)
+    amount over the production store capacity used in the production
+    store saturation terms, with the ratio limited to 13, as per
+    source code of Coron et al. (2017)
+    https://doi.org/10.1016/j.envsoft.2017.05.002
+    """
+    return math.tanh(min(x_over_x1, 13.0))
+
+
+@numba.njit(cache=True, fastmath=True)
+def power(x, exponent):
+    """Return *x* raised to *exponent*, using a multiplication rather
+    than a power for the default production precipitation exponent 2.
+    """
+    if exponent == 2:
+        return x * x
+    return math.pow(x, exponent)
+
+
+@numba.njit(cache=True, fastmath=True)
+def outflow_fraction(u, exponent):
+    """Return the fraction of a store content leaving the store (used
+    for both percolation from the production store and outflow from
+    the routing store) given the ratio *u* of its content over its
+    capacity, i.e. 1 - (1 + u ** (exponent - 1)) ** (1 / (1 - exponent))
+    """
+    if exponent == 5:
+        # default exponent: polynomial 1 + u**4 evaluated with
+        # multiplications and its reciprocal fourth root with square
+        # roots rather than powers
+        u2 = u * u
+        return 1 - 1 / math.sqrt(math.sqrt(1 + u2 * u2))
+    return 1 - math.pow(1 + math.pow(u, exponent - 1), 1 / (1 - exponent))
@@ -0,0 +1,131 @@
+import math
+
+import numba
+
+from .surfacelayer import _gr4_surfacelayer_cell
+from .subsurface import _gr4_subsurface_cell
+from .openwater import _gr4_openwater_cell
+
+
+@numba.guvectorize(
+    [
+        'void(f8[:], f8[:], f8, f8, f8, f8, f8, f8[:], f8, '
+        'f8, f8, f8, f8, f8, f8, f8, f8[:])',
+        'void(f4[:], f4[:], f4, f4, f4, f4, f4, f4[:], f4, '
+        'f4, f4, f4, f4, f4, f4, f4, f4[:])'
+    ],
+    '(t),(t),(),(),(),(),(),(n),(),(),(),(),(),(),(),()->(t)',
+    target='parallel', cache=True
+)
+def run_all_timesteps(rainfall_flux, potential_water_evapotranspiration_flux,
+                      x1, x2, x3, x4,
+                      production_store, nash_cascade_stores, routing_store,
+                      dt, alpha, beta, nu, gamma, omega, phi,
+                      outgoing_water_volume_transport_along_river_channel):
+    """Run the surface layer, subsurface, and openwater components of
+    the GR4 model over all timesteps in one call, outside of unifhy.
+
+    The spatial cells being independent from one another, the time
+    loop is performed for each cell in turn (in parallel across
+    cells), with the states of the cell held in local variables
+    throughout the simulation. The transfers between components are
+    lagged by one timestep, as they are by the unifhy exchanger.
+
+    The time dimension must be the last dimension of the forcing
+    arrays, and the Nash cascade stores must be the last dimension of
+    their initial state array; all other dimensions are broadcast
+    against one another (e.g. to run the model for several cells or
+    several parameter sets at once).
+
+    The forcing arrays can also be `dask.array.Array` chunked over
+    their other dimensions (but with time as a single chunk), to run
+    the cells of grids too large to fit in memory chunk by chunk on
+    all cores, using `dask.array.apply_gufunc` with *output_dtypes*
+    given (so that dask does not need to call the function on dummy
+    data to infer it). Parameters and initial states varying in space
+    must then be `dask.array.Array` chunked like the forcing arrays
+    (e.g. ``dask.array.from_array(x1, chunks=rainfall_flux.chunks[:-1])``).
+
+    :Parameters:
+
+        rainfall_flux: `numpy.ndarray`
+            Rainfall flux in kg m-2 s-1 with time as last dimension.
+
+        potential_water_evapotranspiration_flux: `numpy.ndarray`
+            Potential water evapotranspiration flux in kg m-2 s-1
+            with time as last dimension.
+
+        x1, x2, x3, x4: `numpy.ndarray` or `float`
+            Model parameters, in kg m-2, kg m-2 d-1, kg m-2, and d,
+            respectively, as expected by the components.
+
+        production_store, routing_store: `numpy.ndarray` or `float`
+            Initial states in kg m-2.
+
+        nash_cascade_stores: `numpy.ndarray`
+            Initial states in kg m-2 with the Nash cascade stores as
+            last dimension (its length sets the number of stores).
+
+        dt: `float`
+            Length of the timestep in seconds.
+
+        alpha, beta, nu, gamma, omega, phi: `float`
+            Model constants, as expected by the components (i.e.
+            the components default values are 2, 5, 4/9, 5, 3.5,
+            and 0.9, respectively).
+
+    :Returns:
+
+        `numpy.ndarray`
+            Streamflow at outlet in kg m-2 s-1 with time as last
+            dimension.
+    """
+    q_out = outgoing_water_volume_transport_along_river_channel
+
+    # convert time dependent parameters and constants
+    # Ficchì et al. (2016) https://doi.org/10.1016/j.jhydrol.2016.04.016
+    nu = nu * (86400 / dt) ** 0.25
+    x2 = x2 * (86400 / dt) ** -0.125
+    inv_x3 = (86400 / dt) ** -0.25 / x3
+    inv_x1 = 1 / x1
+
+    nres = nash_cascade_stores.size
+    retention_coefficient = math.exp((1 - nres) / (x4 * (86400 / dt)))
+
+    # initial states
+    s = production_store
+    sh = nash_cascade_stores.copy()
+    r = routing_store
+
+    # initial transfers between components (zero, as in unifhy)
+    s_over_x1 = 0.0
+    pn = 0.0
+    es = 0.0
+    quh = 0.0
+
+    for t in range(q_out.size):
+        # surface layer
+        pn_t, es_t, _ = _gr4_surfacelayer_cell(
+            rainfall_flux[t] * dt,
+            potential_water_evapotranspiration_flux[t] * dt,
+            s_over_x1, x1, inv_x1, alpha
+        )
+
+        # subsurface (each store of the Nash cascade being read before
+        # it is written, the cascade can be updated in place)
+        s, quh_t = _gr4_subsurface_cell(
+            pn, es, s, sh, x1, inv_x1, retention_coefficient,
+            alpha, beta, nu, sh
+        )
+
+        # openwater
+        r, q = _gr4_openwater_cell(
+            quh, r, x2, inv_x3, gamma, omega, phi
+        )
+        q_out[t] = q / dt
+
+        # transfers available to the components at next timestep
+        s_over_x1 = s * inv_x1
+        pn = pn_t
+        es = es_t
+        quh = quh_t
@@ -1,7 +1,67 @@
+import math
+
+import numba
 import numpy as np
 
 import unifhy
 
+from ._utils import as_kernel_array, outflow_fraction
+
+
+@numba.njit(cache=True, fastmath=True)
+def _gr4_openwater_cell(quh, r_, x2, inv_x3, gamma, omega, phi):
+    """Compute inter-catchment exchange, routing store, and direct
+    branch runoff for one cell, returning routing store *r* and total
+    runoff *q*.
+    """
+    # split runoff between direct and routing
+    q9 = quh * phi
+    q1 = quh - q9
+
+    # potential inter-catchment exchange (with routing store clipped
+    # to non-negative values so that the power is always defined,
+    # e.g. for a negative initial state)
+    r_over_x3 = max(r_, 0.0) * inv_x3
+    f = x2 * math.pow(r_over_x3, omega)
+
+    # runoff from routing store
+    r = r_ + q9 + f
+    r_over_x3 = r * inv_x3
+    qr = r * outflow_fraction(r_over_x3, gamma)
+
+    r -= qr
+    r = max(r, 0.0)
+
+    # runoff from direct branch
+    qd = max(q1 + f, 0.0)
+
+    # total runoff
+    q = max(qr + qd, 0.0)
+
+    return r, q
+
+
+@numba.njit(
+    [
+        'void(f8[:], f8[:], f8[:], f8[:], f8, f8, f8, f8, f8[:], f8[:])',
+        'void(f4[:], f4[:], f4[:], f4[:], f8, f8, f8, f8, f4[:], f4[:])'
+    ],
+    cache=True, fastmath=True, parallel=True
+)
+def _gr4_openwater_kernel(quh, r_, x2, inv_x3, gamma, omega, phi, dt,
+                          r_out, q):
+    """Compute inter-catchment exchange, routing store, and direct
+    branch runoff cell by cell in a single pass over flattened spatial
+    arrays, reading *quh* as a flux (i.e. to be multiplied by *dt*),
+    and writing results in *r_out* and *q* (as a flux).
+    """
+    for c in numba.prange(quh.size):
+        r_c, q_c = _gr4_openwater_cell(
+            quh[c] * dt, r_[c], x2[c], inv_x3[c], gamma, omega, phi
+        )
+        r_out[c] = r_c
+        q[c] = q_c / dt
+
 
 class OpenWaterComponent(unifhy.component.OpenWaterComponent):
     """The GR4 ("Génie Rural à 4 paramètres" [in French]) model is a
@@ -85,6 +145,21 @@ class OpenWaterComponent(unifhy.component.OpenWaterComponent):
         if not self.initialised_states:
             routing_store.set_timestep(-1, 0.0)
 
+        # flattened work buffers, reused by the kernel at each timestep
+        size = int(np.prod(self.spaceshape))
+        dtype = unifhy.dtype_float()
+        self._scratch = {
+            'x2': np.empty(size, dtype),
+            'inv_x3': np.empty(size, dtype),
+            'r': np.empty(size, dtype),
+            'q': np.empty(size, dtype)
+        }
+        # parameters the cached work buffers were last computed from
+        self._x2 = None
+        self._x3 = None
+        # precision expected by the compiled kernel
+        self._dtype = dtype
+
     def run(self,
             # from exchanger
             surface_runoff_flux_delivered_to_rivers,
@@ -97,49 +172,48 @@ class OpenWaterComponent(unifhy.component.OpenWaterComponent):
             gamma, omega, phi,
             **kwargs):
 
+        scratch = self._scratch
+
         # some name binding to be consistent with GR4J nomenclature
         dt = self.timedelta_in_seconds
-        quh = surface_runoff_flux_delivered_to_rivers * dt
+        quh = as_kernel_array(surface_runoff_flux_delivered_to_rivers,
+                              self._dtype)
         r_ = routing_store.get_timestep(-1)
 
         # convert time dependent parameters and constants
         # Ficchì et al. (2016) https://doi.org/10.1016/j.jhydrol.2016.04.016
-        x2 = x2 * (86400 / dt) ** -0.125
-        x3 = x3 * (86400 / dt) ** 0.25
-
-        # split runoff between direct and routing
-        q9 = quh * phi
-        q1 = quh - q9
-
-        # potential inter-catchment exchange
-        r_over_x3 = r_ / x3
-        f = x2 * r_over_x3 ** omega
-
-        # runoff from routing store
-        r = r_ + q9 + f
-        r_over_x3 = r / x3
-        qr = r * (1 - (1 + r_over_x3 ** (gamma - 1)) ** (1 / (1 - gamma)))
-
-        r -= qr
-        r *= r > 0
-
-        # runoff from direct branch
-        qd = np.maximum(q1 + f, 0.0)
+        # (only compute them again if different parameters are given,
+        # using reciprocal of x3 in place of divisions by x3)
+        if x2 is not self._x2:
+            np.multiply(np.ravel(x2), (86400 / dt) ** -0.125,
+                        out=scratch['x2'])
+            self._x2 = x2
+        if x3 is not self._x3:
+            np.divide((86400 / dt) ** -0.25, np.ravel(x3),
+                      out=scratch['inv_x3'])
+            self._x3 = x3
+
+        _gr4_openwater_kernel(
+            quh, as_kernel_array(r_, self._dtype),
+            scratch['x2'], scratch['inv_x3'],
+            gamma, omega, phi, dt,
+            scratch['r'], scratch['q']
+        )
 
-        # total runoff
-        q = qr + qd
-        q *= q > 0
+        r = np.reshape(scratch['r'], r_.shape)
+        q = np.reshape(scratch['q'], r_.shape)
 
         # update component states
         routing_store.set_timestep(0, r)
 
+        # (work buffers can be returned, unifhy copies them)
         return (
             # to exchanger
             {},
             # component outputs
             {
                 'outgoing_water_volume_transport_along_river_channel':
-                    q / dt
+                    q
             }
         )
 
@@ -1,7 +1,97 @@
+import numba
 import numpy as np
 
 import unifhy
 
+from ._utils import (
+    as_kernel_array, tanh_limited, power, outflow_fraction
+)
+
+
+@numba.njit(cache=True, fastmath=True)
+def _gr4_subsurface_cell(pn, es, s_, sh_, x1, inv_x1, retention_coefficient,
+                         alpha, beta, nu, sh_out):
+    """Compute production store, percolation, and Nash cascade routing
+    for one cell, writing the Nash cascade stores in *sh_out* (which
+    may be *sh_* itself for an in-place update), and returning
+    production store *s* and cascade outflow *quh*.
+    """
+    # --------------------------------------------------------------
+    # under energy-limited conditions (i.e. remaining water 'pn')
+    # >-------------------------------------------------------------
+
+    # (skip the saturation term evaluation altogether otherwise)
+    if pn > 0.0:
+        s_over_x1 = s_ * inv_x1
+        tanh_pn_over_x1 = tanh_limited(pn * inv_x1)
+
+        ps = (
+            (x1 * (1 - power(s_over_x1, alpha)) * tanh_pn_over_x1)
+            / (1 + s_over_x1 * tanh_pn_over_x1)
+        )
+    else:
+        ps = 0.0
+
+    pr = pn - ps
+
+    # -------------------------------------------------------------<
+
+    # update production store after infiltration and evaporation
+    s = s_ + ps - es
+
+    # percolation from production store
+    s = max(s, 0.0)
+    s_over_x1 = s * inv_x1
+
+    perc = s * outflow_fraction(nu * s_over_x1, beta)
+
+    pr += perc
+
+    # update production store after percolation
+    s -= perc
+
+    # routing through nash cascade (nres stores in series)
+    # all stores share the same outflow coefficient, so each store
+    # keeps a fixed fraction of its content and passes on the rest
+    outflow_coefficient = 1 - retention_coefficient
+
+    qsh = pr
+    for i in range(sh_.size):
+        sh = sh_[i] + qsh
+        sh_out[i] = sh * retention_coefficient
+        qsh = sh * outflow_coefficient
+
+    return s, qsh
+
+
+@numba.njit(
+    [
+        'void(f8[:], f8[:], f8[:], f8[:, :], f8[:], f8[:], f8[:], '
+        'f8, f8, f8, f8, f8[:], f8[:, :], f8[:], f8[:])',
+        'void(f4[:], f4[:], f4[:], f4[:, :], f4[:], f4[:], f4[:], '
+        'f8, f8, f8, f8, f4[:], f4[:, :], f4[:], f4[:])'
+    ],
+    cache=True, fastmath=True, parallel=True
+)
+def _gr4_subsurface_kernel(pn, es, s_, sh_, x1, inv_x1,
+                           retention_coefficient, alpha, beta, nu, dt,
+                           s_out, sh_out, quh, s_over_x1):
+    """Compute production store, percolation, and Nash cascade routing
+    cell by cell in a single pass over flattened spatial arrays (with
+    an additional trailing axis of length *nres* for the Nash cascade
+    stores), reading *pn* and *es* as fluxes (i.e. to be multiplied by
+    *dt*), and writing results in *s_out*, *sh_out*, *quh* (as a flux),
+    and *s_over_x1*.
+    """
+    for c in numba.prange(pn.size):
+        s_c, quh_c = _gr4_subsurface_cell(
+            pn[c] * dt, es[c] * dt, s_[c], sh_[c], x1[c], inv_x1[c],
+            retention_coefficient[c], alpha, beta, nu, sh_out[c]
+        )
+        s_out[c] = s_c
+        quh[c] = quh_c / dt
+        s_over_x1[c] = s_c * inv_x1[c]
+
 
 class SubSurfaceComponent(unifhy.component.SubSurfaceComponent):
     """The GR4 ("Génie Rural à 4 paramètres" [in French]) model is a
@@ -87,12 +177,32 @@ class SubSurfaceComponent(unifhy.component.SubSurfaceComponent):
     def initialise(self,
                    # component states
                    production_store, nash_cascade_stores,
+                   # component constants
+                   nres,
                    **kwargs):
 
         if not self.initialised_states:
             production_store.set_timestep(-1, 0.0)
             nash_cascade_stores.set_timestep(-1, 0.0)
 
+        # flattened work buffers, reused by the kernel at each timestep
+        size = int(np.prod(self.spaceshape))
+        dtype = unifhy.dtype_float()
+        self._scratch = {
+            'x1': np.empty(size, dtype),
+            'inv_x1': np.empty(size, dtype),
+            'retention_coefficient': np.empty(size, dtype),
+            's': np.empty(size, dtype),
+            'sh': np.empty((size, int(nres)), dtype),
+            'quh': np.empty(size, dtype),
+            's_over_x1': np.empty(size, dtype)
+        }
+        # parameters the cached work buffers were last computed from
+        self._x1 = None
+        self._x4 = None
+        # precision expected by the compiled kernel
+        self._dtype = dtype
+
     def run(self,
             # from exchanger
             canopy_liquid_throughfall_and_snow_melt_flux,
@@ -106,87 +216,59 @@ class SubSurfaceComponent(unifhy.component.SubSurfaceComponent):
             alpha, beta, nu, nres,
             **kwargs):
 
+        scratch = self._scratch
+
         # some name binding to be consistent with GR4J nomenclature
         dt = self.timedelta_in_seconds
-        pn = canopy_liquid_throughfall_and_snow_melt_flux * dt
-        es = transpiration_flux_from_root_uptake * dt
+        pn = as_kernel_array(canopy_liquid_throughfall_and_snow_melt_flux,
+                             self._dtype)
+        es = as_kernel_array(transpiration_flux_from_root_uptake,
+                             self._dtype)
         s_ = production_store.get_timestep(-1)
         sh_ = nash_cascade_stores.get_timestep(-1)
 
         # convert time dependent parameters and constants
         # Ficchì et al. (2016) https://doi.org/10.1016/j.jhydrol.2016.04.016
         nu = nu * (86400 / dt) ** 0.25
-        x4 = x4 * (86400 / dt)
-
-        # determine where energy limited conditions are
-        energy_limited = pn > 0.0
-
-        # --------------------------------------------------------------
-        # under energy-limited conditions (i.e. remaining water 'pn')
-        # >-------------------------------------------------------------
-
-        s_over_x1 = s_ / x1
-        pn_over_x1 = pn / x1
-        # limited to 13, as per source code of Coron et al. (2017)
-        # https://doi.org/10.1016/j.envsoft.2017.05.002
-        pn_over_x1[pn_over_x1 > 13.0] = 13.0
-        tanh_pn_over_x1 = np.tanh(pn_over_x1)
-
-        ps = np.where(
-            energy_limited,
-            (x1 * (1 - s_over_x1 ** alpha) * tanh_pn_over_x1)
-            / (1 + s_over_x1 * tanh_pn_over_x1),
-            0.0
-        )
-
-        pr = pn - ps
-
-        # -------------------------------------------------------------<
-
-        # update production store after infiltration and evaporation
-        s = s_ + ps - es
-
-        # percolation from production store
-        s *= s > 0
-        s_over_x1 = s / x1
 
-        perc = (
-            s * (1 - (1 + ((nu * s_over_x1) ** (beta - 1)))
-                 ** (1 / (1 - beta)))
+        # only recompute x1 and its reciprocal if a different x1 is given
+        if x1 is not self._x1:
+            np.copyto(scratch['x1'], as_kernel_array(x1, self._dtype))
+            np.divide(1, scratch['x1'], out=scratch['inv_x1'])
+            self._x1 = x1
+
+        # Nash cascade coefficients only depend on time-invariant x4,
+        # so only compute them again if a different x4 is given
+        if x4 is not self._x4:
+            np.exp((1 - int(nres)) / (np.ravel(x4) * (86400 / dt)),
+                   out=scratch['retention_coefficient'])
+            self._x4 = x4
+
+        _gr4_subsurface_kernel(
+            pn, es, as_kernel_array(s_, self._dtype),
+            np.reshape(as_kernel_array(sh_, self._dtype), (-1, int(nres))),
+            scratch['x1'], scratch['inv_x1'], scratch['retention_coefficient'],
+            alpha, beta, nu, dt,
+            scratch['s'], scratch['sh'], scratch['quh'], scratch['s_over_x1']
         )
 
-        pr += perc
-
-        # update production store after percolation
-        s -= perc
-
-        # routing through nash cascade (nres stores in series)
-        sh = np.zeros(sh_.shape)
-        qsh = np.zeros(sh_.shape)
-
-        outflow_coefficient = 1 - np.exp((1 - nres) / x4)
-
-        sh[..., 0] = sh_[..., 0] + pr
-        qsh[..., 0] = sh[..., 0] * outflow_coefficient
-        sh[..., 0] -= qsh[..., 0]
-        for i in range(1, nres):
-            sh[..., i] = sh_[..., i] + qsh[..., i - 1]
-            qsh[..., i] = sh[..., i] * outflow_coefficient
-            sh[..., i] -= qsh[..., i]
-
-        quh = qsh[..., -1]
+        s = np.reshape(scratch['s'], s_.shape)
+        sh = np.reshape(scratch['sh'], sh_.shape)
+        quh = np.reshape(scratch['quh'], s_.shape)
+        s_over_x1 = np.reshape(scratch['s_over_x1'], s_.shape)
 
         # update component states
         production_store.set_timestep(0, s)
         nash_cascade_stores.set_timestep(0, sh)
 
+        # (work buffers can be returned, unifhy copies them)
         return (
             # to exchanger
             {
                 'surface_runoff_flux_delivered_to_rivers':
-                    quh / dt,
+                    quh,
                 'soil_water_stress_for_transpiration':
-                    s / x1
+                    s_over_x1
             },
             # component outputs
             {}
@@ -1,7 +1,69 @@
+import numba
 import numpy as np
 
 import unifhy
 
+from ._utils import as_kernel_array, tanh_limited, power
+
+
+@numba.njit(cache=True, fastmath=True)
+def _gr4_surfacelayer_cell(p, e, s_over_x1, x1, inv_x1, alpha):
+    """Compute interception and evaporation from the production store
+    for one cell, returning net rainfall *pn*, evaporation from the
+    production store *es*, and actual evapotranspiration *ae*.
+    """
+    # interception
+    e_minus_p = e - p
+
+    # remaining water 'pn' (non-zero under energy-limited conditions)
+    pn = max(-e_minus_p, 0.0)
+
+    # evaporation from production store, only non-zero under
+    # water-limited conditions (i.e. remaining energy 'en'), so only
+    # evaluated under these conditions
+    es = 0.0
+    if e_minus_p > 0.0:
+        en = e_minus_p
+        tanh_en_over_x1 = tanh_limited(en * inv_x1)
+
+        s = s_over_x1 * x1
+        s_alpha_over_x1 = power(s, alpha) * inv_x1
+
+        es = (
+            ((2 * s - s_alpha_over_x1) * tanh_en_over_x1)
+            / (1 + (1 - s_over_x1) * tanh_en_over_x1)
+        )
+
+    # actual evapotranspiration
+    ae = es + p if e_minus_p > 0.0 else e
+
+    return pn, es, ae
+
+
+@numba.njit(
+    [
+        'void(f8[:], f8[:], f8[:], f8[:], f8[:], f8, f8, '
+        'f8[:], f8[:], f8[:])',
+        'void(f4[:], f4[:], f4[:], f4[:], f4[:], f8, f8, '
+        'f4[:], f4[:], f4[:])'
+    ],
+    cache=True, fastmath=True, parallel=True
+)
+def _gr4_surfacelayer_kernel(p, e, s_over_x1, x1, inv_x1, alpha, dt,
+                             pn, es, ae):
+    """Compute interception and evaporation from the production store
+    cell by cell in a single pass over flattened spatial arrays,
+    reading *p* and *e* as fluxes (i.e. to be multiplied by *dt*), and
+    writing results as fluxes in *pn*, *es*, and *ae*.
+    """
+    for c in numba.prange(p.size):
+        pn_c, es_c, ae_c = _gr4_surfacelayer_cell(
+            p[c] * dt, e[c] * dt, s_over_x1[c], x1[c], inv_x1[c], alpha
+        )
+        pn[c] = pn_c / dt
+        es[c] = es_c / dt
+        ae[c] = ae_c / dt
+
 
 class SurfaceLayerComponent(unifhy.component.SurfaceLayerComponent):
     """The GR4 ("Génie Rural à 4 paramètres" [in French]) model is a
@@ -73,7 +135,21 @@ class SurfaceLayerComponent(unifhy.component.SurfaceLayerComponent):
     def initialise(self,
                    # component states
                    **kwargs):
-        pass
+
+        # flattened work buffers, reused by the kernel at each timestep
+        size = int(np.prod(self.spaceshape))
+        dtype = unifhy.dtype_float()
+        self._scratch = {
+            'x1': np.empty(size, dtype),
+            'inv_x1': np.empty(size, dtype),
+            'pn': np.empty(size, dtype),
+            'es': np.empty(size, dtype),
+            'ae': np.empty(size, dtype)
+        }
+        # parameter the cached work buffers were last computed from
+        self._x1 = None
+        # precision expected by the compiled kernel
+        self._dtype = dtype
 
     def run(self,
             # from exchanger
@@ -87,65 +163,45 @@ class SurfaceLayerComponent(unifhy.component.SurfaceLayerComponent):
             alpha,
             **kwargs):
 
+        scratch = self._scratch
+
         # some name binding to be consistent with GR4J nomenclature
         dt = self.timedelta_in_seconds
-        p = rainfall_flux * dt
-        e = potential_water_evapotranspiration_flux * dt
-        s_over_x1 = soil_water_stress_for_transpiration
-
-        # interception
-        e_minus_p = e - p
-        en = np.maximum(e_minus_p, 0.0)
-        pn = np.maximum(-e_minus_p, 0.0)
-
-        # determine where water-/energy-limited conditions are
-        water_limited = e_minus_p >= 0.0
-        energy_limited = ~water_limited
-        
-        # --------------------------------------------------------------
-        # under water-limited conditions (i.e. remaining energy 'en')
-        # >-------------------------------------------------------------
-        
-        en_over_x1 = np.where(water_limited, en / x1, 0.0)
-        # limited to 13, as per source code of Coron et al. (2017)
-        # https://doi.org/10.1016/j.envsoft.2017.05.002
-        en_over_x1[en_over_x1 > 13.0] = 13.0
-        tanh_en_over_x1 = np.tanh(en_over_x1)
-
-        s = np.where(water_limited, s_over_x1 * x1, 0.0)
-        s_alpha_over_x1 = (s ** alpha) / x1
-
-        es = np.where(
-            water_limited,
-            ((2 * s - s_alpha_over_x1) * tanh_en_over_x1)
-             / (1 + (1 - s_over_x1) * tanh_en_over_x1),
-            0.0
+        p = as_kernel_array(rainfall_flux, self._dtype)
+        e = as_kernel_array(potential_water_evapotranspiration_flux,
+                            self._dtype)
+        s_over_x1 = as_kernel_array(soil_water_stress_for_transpiration,
+                                    self._dtype)
+
+        # only recompute x1 and its reciprocal if a different x1 is given
+        if x1 is not self._x1:
+            np.copyto(scratch['x1'], as_kernel_array(x1, self._dtype))
+            np.divide(1, scratch['x1'], out=scratch['inv_x1'])
+            self._x1 = x1
+
+        _gr4_surfacelayer_kernel(
+            p, e, s_over_x1, scratch['x1'], scratch['inv_x1'], alpha, dt,
+            scratch['pn'], scratch['es'], scratch['ae']
         )
 
-        ae = np.where(water_limited, es + p, 0.0)
-
-        # -------------------------------------------------------------<
-
-        # --------------------------------------------------------------
-        # under energy-limited conditions (i.e. remaining water 'pn')
-        # >-------------------------------------------------------------
-
-        ae[energy_limited] = e[energy_limited]
-
-        # -------------------------------------------------------------<
+        # (work buffers can be returned, unifhy copies them)
+        shape = self.spaceshape
+        pn = np.reshape(scratch['pn'], shape)
+        es = np.reshape(scratch['es'], shape)
+        ae = np.reshape(scratch['ae'], shape)
 
         return (
             # to exchanger
             {
                 'canopy_liquid_throughfall_and_snow_melt_flux':
-                    pn / dt,
+                    pn,
                 'transpiration_flux_from_root_uptake':
-                    es / dt
+                    es
             },
             # component outputs
             {
                 'actual_water_evapotranspiration_flux':
-                    ae / dt
+                    ae
             }
         )
 